@@ -0,0 +1,14 @@
+# Production server for Render: `gunicorn -c gunicorn.conf.py main:app`.
+# Keep a single worker so only one scan scheduler runs.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = 1
+worker_class = "gthread"
+threads = 4
+
+
+def post_worker_init(worker):
+    from main import start_bot
+
+    start_bot()
@@ -1,18 +1,52 @@
 import os
+import json
 import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from typing import NamedTuple
 from zoneinfo import ZoneInfo
 
+import numpy as np
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
 from flask import Flask
 
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:  # orjson is optional: fall back to the stdlib parser
+    from json import loads as json_loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional: fall back to plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
 # ============ ENVIRONMENT ============
 
 TD_API_KEY = os.getenv("TWELVEDATA_API_KEY", "").strip()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 CHAT_ID = os.getenv("CHAT_ID", "").strip()
+# HEALTHCHECK=0 runs `python main.py` as a plain worker, without the web server
+HEALTHCHECK = os.getenv("HEALTHCHECK", "1").strip() != "0"
+LOG_LEVEL_ENV = os.getenv("LOG_LEVEL", "").strip().upper() or "INFO"   # e.g. DEBUG, WARNING
+# An unknown name falls back to INFO instead of failing at import
+LOG_LEVEL = LOG_LEVEL_ENV if LOG_LEVEL_ENV in logging.getLevelNamesMapping() else "INFO"
+# Optional directory to keep indicator state across restarts (off when empty)
+CACHE_DIR = os.getenv("CACHE_DIR", "").strip()
 PAIRS_ENV = os.getenv(
     "PAIRS",
     "EURUSD,GBPUSD,USDJPY,EURCAD,GBPAUD,GBPCAD,USDCAD,GBPJPY",
@@ -23,128 +57,479 @@ PAIRS_ENV = os.getenv(
 ALL_PAIRS = [p.strip().upper() for p in PAIRS_ENV.split(",") if p.strip()]
 PAIRS = ALL_PAIRS[:8]
 
+
+class PairMeta(NamedTuple):
+    symbol: str       # TwelveData symbol, e.g. "EUR/USD"
+    pip_factor: int   # pips per 1.0 of price
+    decimals: int     # price decimals in messages
+
+
+def pair_meta(pair: str) -> PairMeta:
+    jpy = pair.endswith("JPY")
+    return PairMeta(
+        symbol=f"{pair[:3]}/{pair[3:]}" if len(pair) == 6 else pair,
+        pip_factor=100 if jpy else 10000,   # 0.01 / 0.0001 ≈ 1 pip
+        decimals=3 if jpy else 5,
+    )
+
+
+# Per-pair constants, resolved once instead of on every fetch/signal
+PAIR_META = {p: pair_meta(p) for p in PAIRS}
+
 # ============ STRATEGY SETTINGS (1H) ============
 
 INTERVAL = "1h"              # 1-hour candles
-SCAN_EVERY_S = 15 * 60       # run every 15 minutes
+BAR_S = 60 * 60              # length of one INTERVAL candle, in seconds
+SCAN_EVERY_S = 15 * 60       # run every 15 minutes, on the clock (:00, :15, ...)
+SCAN_OFFSET_S = 15           # seconds past each boundary, so the new candle is out
+SCAN_JITTER_S = 10           # random 0..10 s added after that offset
+MIN_SCAN_GAP_S = 60          # API credits are per minute: never two scans closer
+
+
+@dataclass(frozen=True, slots=True)
+class StrategyConfig:
+    """Strategy parameters, passed explicitly to the indicator/signal code."""
+    ema_fast: int = 50
+    ema_mid: int = 100
+    ema_slow: int = 200
 
-EMA_FAST = 50
-EMA_MID = 100
-EMA_SLOW = 200
+    rsi_len: int = 14
+    atr_len: int = 14
 
-RSI_LEN = 14
-ATR_LEN = 14
+    rsi_buy_cross: float = 50.0      # RSI crossing UP through 50 in uptrend
+    rsi_sell_cross: float = 50.0     # RSI crossing DOWN through 50 in downtrend
 
-RSI_BUY_CROSS = 50.0         # RSI crossing UP through 50 in uptrend
-RSI_SELL_CROSS = 50.0        # RSI crossing DOWN through 50 in downtrend
+    atr_mult_sl: float = 1.6         # SL distance ≈ 1.6 * ATR
+    tp1_r: float = 1.0               # TP1 = 1R
+    tp2_r: float = 1.8               # TP2 = 1.8R
+    tp3_r: float = 2.6               # TP3 = 2.6R
 
-ATR_MULT_SL = 1.6            # SL distance ≈ 1.6 * ATR
-TP1_R = 1.0                  # TP1 = 1R
-TP2_R = 1.8                  # TP2 = 1.8R
-TP3_R = 2.6                  # TP3 = 2.6R
+    min_sl_pips: float = 7           # ignore tiny / noisy moves
+    max_sl_pips: float = 40          # ignore huge, wide-SL setups
 
-MIN_SL_PIPS = 7              # ignore tiny / noisy moves
-MAX_SL_PIPS = 40             # ignore huge, wide-SL setups
+    # Derived once: EMA smoothing factors, alpha = 2 / (length + 1)
+    alpha_fast: float = field(init=False)
+    alpha_mid: float = field(init=False)
+    alpha_slow: float = field(init=False)
+    min_bars: int = field(init=False)
+    # Offsets of [SL, TP1, TP2, TP3] from entry in units of risk, for a BUY
+    level_r: np.ndarray = field(init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "alpha_fast", 2.0 / (self.ema_fast + 1))
+        object.__setattr__(self, "alpha_mid", 2.0 / (self.ema_mid + 1))
+        object.__setattr__(self, "alpha_slow", 2.0 / (self.ema_slow + 1))
+        object.__setattr__(self, "min_bars", max(self.ema_slow, self.rsi_len, self.atr_len) + 5)
+        object.__setattr__(self, "level_r", np.array([-1.0, self.tp1_r, self.tp2_r, self.tp3_r]))
+
+
+CFG = StrategyConfig()
+
+# Prices are stored as float32: 7 significant digits covers 5-decimal quotes
+# and halves the memory the kernel streams. Indicator state stays float64.
+PRICE_DTYPE = np.float32
+
+HISTORY_BARS = 250           # bars fetched to seed a pair's indicators
+TAIL_BARS = 24               # bars fetched once seeded (covers the overnight pause)
 
 MADRID_TZ = ZoneInfo("Europe/Madrid")
 
+# Direction code -> (label, emoji); the code doubles as the SL/TP sign
+SIDES = {1: ("BUY", "🟢"), -1: ("SELL", "🔴")}
+
+SIGNAL_SEPARATOR = "\n\n──────\n\n"   # between signals batched in one message
+
+# Signal message, filled with a single .format(); dp = the pair's price decimals
+MSG_TEMPLATE = (
+    "📊📉📈 <b>{pair}</b>\n"
+    "{color} <b>{direction}</b>\n"
+    "💰 Price: {price:.{dp}f}\n"
+    "⛔ SL: {sl:.{dp}f}\n"
+    "🥇 TP1: {tp1:.{dp}f}\n"
+    "🥈 TP2: {tp2:.{dp}f}\n"
+    "🥉 TP3: {tp3:.{dp}f}"
+)
+
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOG_LEVEL,
     format="%(asctime)s | %(levelname)s | %(message)s",
 )
 log = logging.getLogger(__name__)
-
-# To avoid duplicate alerts on the same candle
-last_signal_bar = {}   # pair -> last bar datetime
-last_signal_dir = {}   # pair -> "BUY" / "SELL"
+if LOG_LEVEL != LOG_LEVEL_ENV:
+    log.warning("Unknown LOG_LEVEL %r; using INFO", LOG_LEVEL_ENV)
+
+# One pooled keep-alive session for TwelveData and Telegram, so repeated
+# calls skip the TCP/TLS handshake
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+        ),
+    ),
+)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Telegram messages are sent from one background thread, in order, so a
+# slow or failing send never holds up a scan
+# Items are (text, {pair: (bar datetime, direction)} of the alerts in it)
+_telegram_queue: queue.Queue[tuple[str, dict]] = queue.Queue()
+_telegram_lock = threading.Lock()
+_telegram_thread = None
+
+# Indicator state per pair, committed up to the last closed bar:
+# pair -> (bar datetime, state row indexed by the S_* fields below)
+_state = {}
+(
+    S_CLOSE,
+    S_EMA_FAST,
+    S_EMA_MID,
+    S_EMA_SLOW,
+    S_AVG_GAIN,
+    S_AVG_LOSS,
+    S_ATR,
+    S_BARS,
+) = range(8)
+N_STATE = 8
+
+# To avoid duplicate alerts on the same candle:
+# pair -> (bar datetime, "BUY" / "SELL") of the last alert sent
+last_signal = {}
+# Same, but only alerts Telegram confirmed; this is what CACHE_DIR keeps,
+# so a restart never suppresses an alert that was still queued
+_delivered = {}
 
 
 # ============ HELPERS ============
 
-def td_symbol(pair: str) -> str:
-    """Convert 'EURUSD' -> 'EUR/USD' for TwelveData."""
-    pair = pair.upper()
-    if len(pair) == 6:
-        return f"{pair[:3]}/{pair[3:]}"
-    return pair
+@dataclass(slots=True)
+class Bars:
+    """OHLC history of one pair as plain arrays, oldest bar first."""
+    dt: np.ndarray      # datetime64[s]
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
 
+    def __len__(self) -> int:
+        return len(self.close)
 
-def fetch_data(pair: str) -> pd.DataFrame:
-    """Fetch 1H historical data from TwelveData."""
+
+def parse_bars(values: list[dict]) -> Bars:
+    """
+    Turn TwelveData `values` rows into Bars.
+
+    Raises ValueError/TypeError on a malformed row or a non-finite price:
+    one NaN would stick in the pair's carried EMA/RSI/ATR state.
+    """
+    n = len(values)
+
+    def column(name: str) -> np.ndarray:
+        return np.fromiter((float(v[name]) for v in values), dtype=PRICE_DTYPE, count=n)
+
+    dt = np.array([v["datetime"] for v in values], dtype="datetime64[s]")
+    bars = Bars(dt=dt, high=column("high"), low=column("low"), close=column("close"))
+    if not (np.isfinite(bars.high).all() and np.isfinite(bars.low).all() and np.isfinite(bars.close).all()):
+        raise ValueError("non-finite price in TwelveData values")
+
+    # order=asc already returns oldest first; only sort if that ever breaks
+    if n > 1 and not (dt[1:] > dt[:-1]).all():
+        order = np.argsort(dt, kind="stable")
+        bars = Bars(dt=dt[order], high=bars.high[order], low=bars.low[order], close=bars.close[order])
+    return bars
+
+
+def fetch_data_batch(pairs: list[str], outputsize: int = HISTORY_BARS) -> dict[str, Bars]:
+    """
+    Fetch the last `outputsize` 1H bars of several pairs with one
+    TwelveData request.
+
+    A symbol the API rejects, or whose rows don't parse, is logged and
+    left out of the result.
+    """
     if not TD_API_KEY:
         raise ValueError("TWELVEDATA_API_KEY is missing")
 
     url = "https://api.twelvedata.com/time_series"
     params = {
-        "symbol": td_symbol(pair),
+        "symbol": ",".join(PAIR_META[p].symbol for p in pairs),
         "interval": INTERVAL,
         "apikey": TD_API_KEY,
-        "outputsize": 250,
+        "outputsize": outputsize,
         "order": "asc",
+        "timezone": "UTC",
     }
-    r = requests.get(url, params=params, timeout=20)
+    r = SESSION.get(url, params=params, timeout=20)
     r.raise_for_status()
-    data = r.json()
+    data = json_loads(r.content)
 
-    if "values" not in data:
+    if data.get("status") == "error":
         raise ValueError(f"TwelveData error: {data}")
+    # One symbol comes back bare; several are keyed by symbol
+    if len(pairs) == 1:
+        data = {PAIR_META[pairs[0]].symbol: data}
+
+    out = {}
+    for pair in pairs:
+        payload = data.get(PAIR_META[pair].symbol) or {}
+        if "values" not in payload:
+            log.error("Error %s: TwelveData error: %s", pair, payload)
+            continue
+        try:
+            out[pair] = parse_bars(payload["values"])
+        except (KeyError, TypeError, ValueError) as e:
+            log.error("Error %s: bad TwelveData values: %s", pair, e)
+    return out
+
+
+# The indicator kernel is a plain loop so Numba can compile it;
+# without numba installed it still runs, just as ordinary Python.
+# Explicit signatures compile it at import (or load it from the on-disk
+# cache in __pycache__; point NUMBA_CACHE_DIR elsewhere if that is
+# read-only), so the first scan never pays for compilation.
+_P = np.dtype(PRICE_DTYPE).name
+_STORE_SIG = "void(f8[:, ::1], i8, f8, f8, f8, f8, f8, f8, f8, f8)"
+_ADVANCE_SIG = (
+    f"void(f8[:, ::1], f8[:, ::1], {_P}[:, ::1], {_P}[:, ::1], {_P}[:, ::1], "
+    "i8[::1], f8, f8, f8, i8, i8)"
+)
 
-    df = pd.DataFrame(data["values"])
-    for col in ["open", "high", "low", "close"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
 
-    df["datetime"] = pd.to_datetime(df["datetime"])
-    df = df.sort_values("datetime").reset_index(drop=True)
-    return df
+@njit(_STORE_SIG, cache=True)
+def _store_nb(out, p, close, ema_f, ema_m, ema_s, avg_gain, avg_loss, atr, n):
+    out[p, S_CLOSE] = close
+    out[p, S_EMA_FAST] = ema_f
+    out[p, S_EMA_MID] = ema_m
+    out[p, S_EMA_SLOW] = ema_s
+    out[p, S_AVG_GAIN] = avg_gain
+    out[p, S_AVG_LOSS] = avg_loss
+    out[p, S_ATR] = atr
+    out[p, S_BARS] = n
+
+
+@njit(_ADVANCE_SIG, cache=True)
+def _advance_nb(state, forming, high, low, close, start, a_fast, a_mid, a_slow, rsi_len, atr_len):
+    """
+    Single fused pass over bars start[p]: of each pair's (pairs, bars) row.
+
+    Every bar but the last is committed back into `state`; the last
+    (still-forming) bar is applied on top and written to `forming`.
+    EMAs seed on the first close; RSI and ATR use Wilder smoothing
+    seeded with an SMA over their first `length` values. The running
+    values live in locals, so each price is read exactly once.
+    """
+    n_bars = close.shape[1]
+    for p in range(close.shape[0]):
+        prev = state[p, S_CLOSE]
+        ema_f = state[p, S_EMA_FAST]
+        ema_m = state[p, S_EMA_MID]
+        ema_s = state[p, S_EMA_SLOW]
+        avg_gain = state[p, S_AVG_GAIN]
+        avg_loss = state[p, S_AVG_LOSS]
+        atr = state[p, S_ATR]
+        n = state[p, S_BARS]
+
+        for t in range(start[p], n_bars):
+            if t == n_bars - 1:
+                _store_nb(state, p, prev, ema_f, ema_m, ema_s, avg_gain, avg_loss, atr, n)
+
+            h = high[p, t]
+            l = low[p, t]
+            c = close[p, t]
+
+            if n == 0:
+                ema_f = c
+                ema_m = c
+                ema_s = c
+                tr = h - l
+            else:
+                ema_f += a_fast * (c - ema_f)
+                ema_m += a_mid * (c - ema_m)
+                ema_s += a_slow * (c - ema_s)
+
+                delta = c - prev
+                gain = delta if delta > 0.0 else 0.0
+                loss = -delta if delta < 0.0 else 0.0
+                if n < rsi_len:
+                    avg_gain += gain
+                    avg_loss += loss
+                elif n == rsi_len:
+                    avg_gain = (avg_gain + gain) / rsi_len
+                    avg_loss = (avg_loss + loss) / rsi_len
+                else:
+                    avg_gain = (avg_gain * (rsi_len - 1) + gain) / rsi_len
+                    avg_loss = (avg_loss * (rsi_len - 1) + loss) / rsi_len
+
+                tr = max(h - l, abs(h - prev), abs(l - prev))
+
+            if n + 1 < atr_len:
+                atr += tr
+            elif n + 1 == atr_len:
+                atr = (atr + tr) / atr_len
+            else:
+                atr = (atr * (atr_len - 1) + tr) / atr_len
+
+            prev = c
+            n += 1
+
+        _store_nb(forming, p, prev, ema_f, ema_m, ema_s, avg_gain, avg_loss, atr, n)
+
+
+def snapshot(state: np.ndarray, cfg: StrategyConfig) -> dict[str, np.ndarray]:
+    """Indicator values held in each state row (NaN while warming up)."""
+    bars = state[:, S_BARS]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = state[:, S_AVG_GAIN] / state[:, S_AVG_LOSS]
+        rsi = 100.0 - 100.0 / (1.0 + rs)
+    rsi[bars - 1 < cfg.rsi_len] = np.nan
+    return {
+        "close": state[:, S_CLOSE],
+        "ema_fast": state[:, S_EMA_FAST],
+        "ema_mid": state[:, S_EMA_MID],
+        "ema_slow": state[:, S_EMA_SLOW],
+        "rsi": rsi,
+        "atr": np.where(bars >= cfg.atr_len, state[:, S_ATR], np.nan),
+    }
+
+
+def update_indicators(bars: dict[str, Bars], cfg: StrategyConfig) -> dict[str, np.ndarray]:
+    """
+    Bring every pair's indicator state up to its last closed bar, then
+    apply the still-forming bar to a copy without committing it.
+
+    Only bars newer than the stored state are processed; a pair without
+    state (or whose state is no longer in the window) is seeded from the
+    full history. Returns (pairs, 2) arrays ordered [prev, now].
+    """
+    pairs = list(bars)
+    state = np.zeros((len(pairs), N_STATE))
+    first_new = []
+    for i, pair in enumerate(pairs):
+        times = bars[pair].dt
+        new_from = 0
+        cached = _state.get(pair)
+        if cached is not None:
+            last_time, row = cached
+            pos = int(np.searchsorted(times, last_time))
+            if pos < len(times) - 1 and times[pos] == last_time:
+                state[i] = row
+                new_from = pos + 1
+        first_new.append(new_from)
+
+    # Right-align the new bars of every pair; the last column is the forming bar
+    width = max(len(bars[p]) - s for p, s in zip(pairs, first_new))
+    high, low, close = (np.full((len(pairs), width), np.nan, dtype=PRICE_DTYPE) for _ in range(3))
+    start = np.empty(len(pairs), dtype=np.int64)
+    for i, (pair, new_from) in enumerate(zip(pairs, first_new)):
+        b = bars[pair]
+        start[i] = width - (len(b) - new_from)
+        high[i, start[i]:] = b.high[new_from:]
+        low[i, start[i]:] = b.low[new_from:]
+        close[i, start[i]:] = b.close[new_from:]
+
+    forming = np.empty_like(state)
+    _advance_nb(
+        state, forming, high, low, close, start,
+        cfg.alpha_fast, cfg.alpha_mid, cfg.alpha_slow, cfg.rsi_len, cfg.atr_len,
+    )
+    for i, pair in enumerate(pairs):
+        _state[pair] = (bars[pair].dt[-2], state[i].copy())
 
+    prev = snapshot(state, cfg)
+    now = snapshot(forming, cfg)
 
-def ema(series: pd.Series, length: int) -> pd.Series:
-    return series.ewm(span=length, adjust=False).mean()
+    return {name: np.column_stack([prev[name], now[name]]) for name in prev}
 
 
-def rsi(series: pd.Series, length: int = 14) -> pd.Series:
-    delta = series.diff()
-    gain = (delta.clip(lower=0)).rolling(length).mean()
-    loss = (-delta.clip(upper=0)).rolling(length).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
+def _state_key(cfg: StrategyConfig) -> np.ndarray:
+    """Settings a saved state depends on; a mismatch discards it."""
+    return np.array([N_STATE, cfg.ema_fast, cfg.ema_mid, cfg.ema_slow, cfg.rsi_len, cfg.atr_len])
 
 
-def atr(df: pd.DataFrame, length: int = 14) -> pd.Series:
-    high, low, close = df["high"], df["close"], df["close"]
-    prev_close = close.shift(1)
-    tr = pd.concat(
-        [
-            high - low,
-            (high - prev_close).abs(),
-            (low - prev_close).abs(),
-        ],
-        axis=1,
-    ).max(axis=1)
-    return tr.rolling(length).mean()
+def save_state(cfg: StrategyConfig) -> None:
+    """Write the committed indicator state to CACHE_DIR (no-op when unset)."""
+    if not CACHE_DIR or not _state:
+        return
+    pairs = list(_state)
+    path = os.path.join(CACHE_DIR, "state.npz")
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                key=_state_key(cfg),
+                pairs=np.array(pairs),
+                times=np.array([_state[p][0] for p in pairs], dtype="datetime64[s]"),
+                rows=np.stack([_state[p][1] for p in pairs]),
+            )
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        log.warning("Could not save state to %s: %s", path, e)
+
+
+def load_state(cfg: StrategyConfig) -> None:
+    """
+    Restore indicator state saved by a previous run, so a restart only
+    fetches the tail. fetch_all sends any pair whose saved bar is older
+    than the tail straight to the history request instead.
+    """
+    if not CACHE_DIR:
+        return
+    path = os.path.join(CACHE_DIR, "state.npz")
+    try:
+        with np.load(path) as saved:
+            if not np.array_equal(saved["key"], _state_key(cfg)):
+                log.info("Saved state in %s is for other settings; ignoring it", path)
+                return
+            for pair, t, row in zip(saved["pairs"], saved["times"], saved["rows"]):
+                if pair in PAIR_META:
+                    _state[str(pair)] = (t, row)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log.warning("Could not load state from %s: %s", path, e)
+        return
+    log.info("Restored indicator state for %d pairs", len(_state))
 
 
-def cross_above(x_now, y_now, x_prev, y_prev) -> bool:
-    return x_prev <= y_prev and x_now > y_now
+def save_last_signals() -> None:
+    """Write delivered alerts to CACHE_DIR, so a restart doesn't resend them."""
+    if not CACHE_DIR:
+        return
+    path = os.path.join(CACHE_DIR, "last_signal.json")
+    data = {pair: [t.isoformat(), d] for pair, (t, d) in _delivered.items()}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        log.warning("Could not save last signals to %s: %s", path, e)
 
 
-def cross_below(x_now, y_now, x_prev, y_prev) -> bool:
-    return x_prev >= y_prev and x_now < y_now
+def load_last_signals() -> None:
+    """Restore last_signal saved by a previous run."""
+    if not CACHE_DIR:
+        return
+    path = os.path.join(CACHE_DIR, "last_signal.json")
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        for pair, (t, d) in data.items():
+            last_signal[pair] = _delivered[pair] = (datetime.fromisoformat(t), d)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log.warning("Could not load last signals from %s: %s", path, e)
 
 
 def pips_from_delta(pair: str, delta: float) -> float:
     """Convert price distance to pips (approx)."""
-    if pair.endswith("JPY"):
-        return abs(delta) * 100  # 0.01 ≈ 1 pip
-    return abs(delta) * 10000    # 0.0001 ≈ 1 pip
-
-
-def fmt_price(pair: str, price: float) -> str:
-    """Nice decimal formatting for JPY vs non-JPY."""
-    if pair.endswith("JPY"):
-        return f"{price:.3f}"
-    else:
-        return f"{price:.5f}"
+    return abs(delta) * PAIR_META[pair].pip_factor
 
 
 def trading_hours_ok(now_utc: datetime | None = None) -> bool:
@@ -159,11 +544,38 @@ def trading_hours_ok(now_utc: datetime | None = None) -> bool:
     return start <= local <= end
 
 
-def send_telegram(text: str) -> None:
+def send_telegram(text: str, alerts: dict | None = None) -> None:
+    """
+    Queue a message for the Telegram sender thread; returns immediately.
+
+    `alerts` ({pair: (bar datetime, direction)}) are recorded as delivered
+    once Telegram accepts the message.
+    """
+    global _telegram_thread
     if not BOT_TOKEN or not CHAT_ID:
         log.error("Missing BOT_TOKEN or CHAT_ID")
         return
 
+    with _telegram_lock:
+        if _telegram_thread is None:
+            _telegram_thread = threading.Thread(target=_telegram_worker, name="telegram", daemon=True)
+            _telegram_thread.start()
+    _telegram_queue.put((text, alerts or {}))
+
+
+def _telegram_worker() -> None:
+    while True:
+        text, alerts = _telegram_queue.get()
+        try:
+            if _post_telegram(text) and alerts:
+                _delivered.update(alerts)
+                save_last_signals()
+        finally:
+            _telegram_queue.task_done()
+
+
+def _post_telegram(text: str) -> bool:
+    """Send one message; True when Telegram accepted it."""
     url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
     data = {
         "chat_id": CHAT_ID,
@@ -172,80 +584,76 @@ def send_telegram(text: str) -> None:
     }
 
     try:
-        resp = requests.post(url, json=data, timeout=15)
+        resp = SESSION.post(url, data=json_dumps(data), headers=JSON_HEADERS, timeout=15)
         if not resp.ok:
             log.error("Telegram send failed: %s", resp.text)
+        return resp.ok
     except Exception as e:
         log.error("Telegram send exception: %s", e)
+        return False
 
 
 # ============ SIGNAL LOGIC (1H TREND + PULLBACK) ============
 
-def check_signal(pair: str) -> str | None:
-    df = fetch_data(pair)
-    if len(df) < max(EMA_SLOW, RSI_LEN, ATR_LEN) + 5:
-        log.info("Not enough data for %s", pair)
-        return None
-
-    close = df["close"]
-    ema_fast = ema(close, EMA_FAST)
-    ema_mid = ema(close, EMA_MID)
-    ema_slow = ema(close, EMA_SLOW)
-    rsi_val = rsi(close, RSI_LEN)
-    atr_val = atr(df, ATR_LEN)
-
-    # Latest and previous bar
-    c_now = close.iloc[-1]
-    c_prev = close.iloc[-2]
-
-    e_fast_now = ema_fast.iloc[-1]
-    e_fast_prev = ema_fast.iloc[-2]
+def signal_directions(ind: dict[str, np.ndarray], cfg: StrategyConfig) -> np.ndarray:
+    """
+    Setup direction for every pair at once: +1 BUY, -1 SELL, 0 none.
 
-    e_mid_now = ema_mid.iloc[-1]
-    e_slow_now = ema_slow.iloc[-1]
-
-    rsi_now = rsi_val.iloc[-1]
-    rsi_prev = rsi_val.iloc[-2]
-
-    atr_now = atr_val.iloc[-1]
-    bar_time = df["datetime"].iloc[-1].to_pydatetime()
-
-    # Avoid duplicate alerts on the same bar
-    last_bar = last_signal_bar.get(pair)
-    if last_bar is not None and bar_time == last_bar:
-        return None
+    Comparisons against NaN (indicators still warming up) are False,
+    so those pairs come out as 0.
+    """
+    c_prev, c_now = ind["close"].T
+    e_fast_prev, e_fast_now = ind["ema_fast"].T
+    e_mid_now = ind["ema_mid"][:, -1]
+    e_slow_now = ind["ema_slow"][:, -1]
+    rsi_prev, rsi_now = ind["rsi"].T
 
     # Trend filters
-    uptrend = e_fast_now > e_mid_now > e_slow_now and c_now > e_fast_now
-    downtrend = e_fast_now < e_mid_now < e_slow_now and c_now < e_fast_now
+    uptrend = (e_fast_now > e_mid_now) & (e_mid_now > e_slow_now) & (c_now > e_fast_now)
+    downtrend = (e_fast_now < e_mid_now) & (e_mid_now < e_slow_now) & (c_now < e_fast_now)
+
+    # BUY: uptrend, price bouncing above EMA50, RSI crossing UP through 50.
+    # The trend filter already puts the close on the right side of EMA50
+    # now, so the bounce only needs the previous bar on the other side.
+    buy = (
+        uptrend
+        & (c_prev <= e_fast_prev)
+        & (rsi_prev < cfg.rsi_buy_cross)
+        & (rsi_now >= cfg.rsi_buy_cross)
+    )
 
-    if not uptrend and not downtrend:
-        return None
+    # SELL: downtrend, price bouncing below EMA50, RSI crossing DOWN through 50
+    sell = (
+        downtrend
+        & (c_prev >= e_fast_prev)
+        & (rsi_prev > cfg.rsi_sell_cross)
+        & (rsi_now <= cfg.rsi_sell_cross)
+    )
 
-    direction = None
+    return buy.astype(np.int8) - sell.astype(np.int8)
 
-    # BUY setup: uptrend, price bouncing above EMA50, RSI crossing UP through 50
-    if uptrend:
-        bounce = cross_above(c_now, e_fast_now, c_prev, e_fast_prev)
-        rsi_cross = rsi_prev < RSI_BUY_CROSS <= rsi_now
-        if bounce and rsi_cross:
-            direction = "BUY"
 
-    # SELL setup: downtrend, price bouncing below EMA50, RSI crossing DOWN through 50
-    if downtrend and direction is None:
-        bounce = cross_below(c_now, e_fast_now, c_prev, e_fast_prev)
-        rsi_cross = rsi_prev > RSI_SELL_CROSS >= rsi_now
-        if bounce and rsi_cross:
-            direction = "SELL"
+def check_signal(
+    pair: str,
+    bar_time: datetime,
+    code: int,
+    ind: dict[str, np.ndarray],
+    cfg: StrategyConfig,
+) -> str | None:
+    """Build the alert for one pair's setup, given its [prev, now] indicator values."""
+    c_now = ind["close"][-1]
+    atr_now = ind["atr"][-1]
 
-    if direction is None:
+    # Avoid duplicate alerts on the same bar
+    last = last_signal.get(pair)
+    if last is not None and last[0] == bar_time:
         return None
 
     # ATR-based SL / TP, with pip sanity check
-    risk_price = atr_now * ATR_MULT_SL
+    risk_price = atr_now * cfg.atr_mult_sl
     risk_pips = pips_from_delta(pair, risk_price)
 
-    if pd.isna(risk_price) or risk_pips < MIN_SL_PIPS or risk_pips > MAX_SL_PIPS:
+    if np.isnan(risk_price) or risk_pips < cfg.min_sl_pips or risk_pips > cfg.max_sl_pips:
         log.info(
             "Skipping %s: risk_pips=%.1f (ATR too small/large)",
             pair,
@@ -254,34 +662,80 @@ def check_signal(pair: str) -> str | None:
         return None
 
     price = c_now
-
-    if direction == "BUY":
-        sl = price - risk_price
-        tp1 = price + risk_price * TP1_R
-        tp2 = price + risk_price * TP2_R
-        tp3 = price + risk_price * TP3_R
-        color = "🟢"
-    else:
-        sl = price + risk_price
-        tp1 = price - risk_price * TP1_R
-        tp2 = price - risk_price * TP2_R
-        tp3 = price - risk_price * TP3_R
-        color = "🔴"
+    direction, color = SIDES[code]
+    sl, tp1, tp2, tp3 = price + code * risk_price * cfg.level_r
 
     # Remember last signal bar/direction
-    last_signal_bar[pair] = bar_time
-    last_signal_dir[pair] = direction
-
-    text = (
-        f"📊📉📈 <b>{pair}</b>\n"
-        f"{color} <b>{direction}</b>\n"
-        f"💰 Price: {fmt_price(pair, price)}\n"
-        f"⛔ SL: {fmt_price(pair, sl)}\n"
-        f"🥇 TP1: {fmt_price(pair, tp1)}\n"
-        f"🥈 TP2: {fmt_price(pair, tp2)}\n"
-        f"🥉 TP3: {fmt_price(pair, tp3)}"
+    last_signal[pair] = (bar_time, direction)
+
+    return MSG_TEMPLATE.format(
+        pair=pair,
+        color=color,
+        direction=direction,
+        price=price,
+        sl=sl,
+        tp1=tp1,
+        tp2=tp2,
+        tp3=tp3,
+        dp=PAIR_META[pair].decimals,
     )
-    return text
+
+
+def fetch_batch_logged(pairs: list[str], outputsize: int) -> dict[str, Bars]:
+    """fetch_data_batch, logging a failed request instead of raising."""
+    try:
+        return fetch_data_batch(pairs, outputsize)
+    except Exception as e:
+        log.error("Error %s: %s", ",".join(pairs), e)
+        return {}
+
+
+def fetch_all(pairs: list[str], min_bars: int) -> dict[str, Bars]:
+    """
+    Fetch all pairs in at most two batch requests; failed or short pairs
+    are skipped.
+
+    Seeded pairs only fetch the recent tail. Unseeded pairs, and pairs
+    whose last committed bar is older than the tail (their state is
+    dropped), fetch the full history. Every pair is requested at most
+    once per scan, since TwelveData charges credits per symbol.
+    """
+    # The tail ends with the forming bar and reaches back at least
+    # TAIL_BARS - 1 closed bars (further across market closures)
+    now_s = int(time.time())
+    oldest = np.datetime64(now_s - now_s % BAR_S - (TAIL_BARS - 1) * BAR_S, "s")
+    for pair in pairs:
+        cached = _state.get(pair)
+        if cached is not None and cached[0] < oldest:
+            _state.pop(pair)
+
+    seeded = [p for p in pairs if p in _state]
+    unseeded = [p for p in pairs if p not in _state]
+
+    fetched = {}
+    if seeded:
+        for pair, tail in fetch_batch_logged(seeded, TAIL_BARS).items():
+            if _state[pair][0] in tail.dt[:-1]:
+                fetched[pair] = tail
+            else:
+                # Tail unexpectedly short: reseed on the next scan rather
+                # than requesting the pair twice in this one
+                log.info("Tail for %s misses its last bar; reseeding next scan", pair)
+                _state.pop(pair, None)
+
+    if unseeded:
+        fetched.update(fetch_batch_logged(unseeded, HISTORY_BARS))
+
+    bars = {}
+    for pair in pairs:
+        b = fetched.get(pair)
+        if b is None:
+            continue
+        if pair not in _state and len(b) < min_bars:
+            log.info("Not enough data for %s", pair)
+            continue
+        bars[pair] = b
+    return bars
 
 
 def run_scan():
@@ -291,17 +745,35 @@ def run_scan():
         log.info("Outside Madrid trading hours – no scan.")
         return
 
-    for pair in PAIRS:
+    bars = fetch_all(PAIRS, CFG.min_bars)
+    if not bars:
+        return
+
+    ind = update_indicators(bars, CFG)
+    save_state(CFG)
+    codes = signal_directions(ind, CFG)
+
+    signals = []
+    alerts = {}
+    for i, pair in enumerate(bars):
         try:
-            signal = check_signal(pair)
+            signal = None
+            if codes[i]:
+                bar_time = bars[pair].dt[-1].item()
+                signal = check_signal(pair, bar_time, codes[i], {k: v[i] for k, v in ind.items()}, CFG)
             if signal:
                 log.info("Signal for %s", pair)
-                send_telegram(signal)
+                signals.append(signal)
+                alerts[pair] = last_signal[pair]
             else:
-                log.info("No valid signal for %s", pair)
+                log.debug("No valid signal for %s", pair)
         except Exception as e:
             log.error("Error %s: %s", pair, e)
 
+    # One Telegram message per scan, however many pairs fired
+    if signals:
+        send_telegram(SIGNAL_SEPARATOR.join(signals), alerts)
+
 
 # ============ FLASK KEEP-ALIVE ============
 
@@ -313,17 +785,53 @@ def health():
     return "OK", 200
 
 
-def main():
+def start_bot(blocking: bool = False) -> BaseScheduler:
+    """
+    Start the scan scheduler; the first scan runs right away unless an
+    aligned scan is less than MIN_SCAN_GAP_S away.
+
+    With blocking=True the scheduler runs in the calling thread and this
+    never returns.
+    """
     log.info("🚀 Starting Forex Signal Bot (1H swing mode)")
     log.info("Pairs in use (max 8): %s", ", ".join(PAIRS))
+    load_state(CFG)
+    load_last_signals()
+
+    # Scheduler in UTC. One job needs one worker thread; a scan that
+    # overruns is coalesced instead of queued or run twice at once.
+    scheduler_cls = BlockingScheduler if blocking else BackgroundScheduler
+    sched = scheduler_cls(
+        timezone="UTC",
+        executors={"default": {"type": "threadpool", "max_workers": 1}},
+        job_defaults={"coalesce": True, "max_instances": 1},
+    )
+    trigger = CronTrigger(
+        minute=f"*/{SCAN_EVERY_S // 60}",
+        second=SCAN_OFFSET_S,
+        jitter=SCAN_JITTER_S,
+        timezone="UTC",
+    )
+    # Scan right away, unless the first aligned scan is due so soon that
+    # both would land inside the same per-minute credit window
+    job_kwargs = {}
+    now = datetime.now(timezone.utc)
+    next_fire = trigger.get_next_fire_time(None, now)
+    if (next_fire - now).total_seconds() >= MIN_SCAN_GAP_S:
+        job_kwargs["next_run_time"] = now
+    sched.add_job(run_scan, trigger, **job_kwargs)
+    sched.start()
+    return sched
 
-    # First scan on startup
-    run_scan()
 
-    # Background scheduler in UTC
-    sched = BackgroundScheduler(timezone="UTC")
-    sched.add_job(run_scan, "interval", seconds=SCAN_EVERY_S)
-    sched.start()
+def main():
+    """Local entry point: scheduler plus Flask's built-in server, or the
+    scheduler alone when HEALTHCHECK=0."""
+    if not HEALTHCHECK:
+        start_bot(blocking=True)
+        return
+
+    start_bot()
 
     port = int(os.getenv("PORT", "8080"))
     app.run(host="0.0.0.0", port=port, debug=False)